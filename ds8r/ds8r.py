@@ -2,14 +2,50 @@
 Define python class 'DS8R' and its method 'run()' used to control DS8R device.
 """
 
+import ctypes
+import logging
+import math
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 
 __all__ = ['DS8R']
 
+logger = logging.getLogger(__name__)
+
 api_path = os.path.join(
     os.path.dirname(os.path.abspath(__file__)),
     'DS8R_API')
 
+dll_path = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'D128RProxy.dll')
+
+# Parameter names in the order of the DGD128_Set and DGD128_Get arguments.
+_PARAM_NAMES = ('mode', 'polarity', 'source', 'demand',
+                'pulse_width', 'dwell', 'recovery', 'enabled')
+
+# Output buffer of `DS8R.get_state()`, ordered as the DGD128_Get arguments
+# and shared by all instances since they drive the same device. The
+# by-reference arguments point into it and are built only once.
+_get_buf = (ctypes.c_long * 8)()
+_get_args = tuple(
+    ctypes.byref(ctypes.c_long.from_buffer(_get_buf, i * ctypes.sizeof(ctypes.c_long)))
+    for i in range(8))
+_state = dict.fromkeys(_PARAM_NAMES, 0)
+
+# Final part of each `DS8R.run_train()` interval, in seconds, that is
+# busy-waited instead of slept to keep the pulse onsets accurate. Before
+# Python 3.11, `time.sleep` on Windows rounds up to the ~15.6 ms system tick.
+if sys.platform == 'win32' and sys.version_info < (3, 11):
+    _SPIN_WAIT = 20e-3
+else:
+    _SPIN_WAIT = 2e-3
+
+# DGD128 functions of D128RProxy.dll, bound by `DS8R._load_dll()`.
+_dll_set = _dll_get = _dll_trigger = None
+
 
 class DS8R:
     """
@@ -105,6 +141,26 @@ class DS8R:
     >>> c.run()
     """
 
+    __slots__ = ('_mode', '_polarity', '_source', '_demand', '_pulse_width',
+                 '_dwell', '_recovery', '_enabled', '_demand_over_safe',
+                 '_params', '__weakref__')
+
+    _dll = None
+    _dll_loaded = False
+    _fns_defined = False
+    # Parameters last applied through `upload_parameters()`, shared by all
+    # instances since they drive the same device.
+    _uploaded = None
+    # Single worker thread for `trigger_async()`, created on first use, the
+    # last output submitted to it, and that output while it is in flight.
+    _executor = None
+    _last_async = None
+    _pending = None
+
+    _STATE_FMT = ('Mode: {mode}\nPolarity: {polarity}\nSource: {source}\n'
+                  'Demand: {demand}\nPulse_width: {pulse_width}\nDwell: {dwell}\n'
+                  'Recovery: {recovery}\nEnabled: {enabled}')
+
     def __init__(self,
                  mode: int = 1,
                  polarity: int = 1,
@@ -123,9 +179,52 @@ class DS8R:
         self.recovery = recovery
         self.enabled = enabled
 
+        if not DS8R._dll_loaded:
+            DS8R._load_dll(dll_path)
+
+    @classmethod
+    def _load_dll(cls, path):
+        global _dll_set, _dll_get, _dll_trigger
+
+        cls._dll_loaded = True
+        try:
+            cls._dll = ctypes.WinDLL(path)
+        except (AttributeError, OSError) as e:
+            # Without the proxy DLL, fall back to spawning DS8R_API
+            # on every call of `run()`.
+            logger.warning('Could not load %s (%s); run() falls back to DS8R_API, '
+                           'and the other device methods are unavailable.', path, e)
+            cls._dll = None
+            return
+
+        if not cls._fns_defined:
+            cls._define_functions()
+            cls._fns_defined = True
+
+        _dll_set = cls._dll.DGD128_Set
+        _dll_get = cls._dll.DGD128_Get
+        _dll_trigger = cls._dll.DGD128_Trigger
+
+    @classmethod
+    def _define_functions(cls):
+        dll = cls._dll
+        dll.DGD128_Set.argtypes = [ctypes.c_long] * 8
+        dll.DGD128_Set.restype = ctypes.c_int
+        dll.DGD128_Get.argtypes = [ctypes.POINTER(ctypes.c_long)] * 8
+        dll.DGD128_Get.restype = ctypes.c_int
+        dll.DGD128_Trigger.argtypes = []
+        dll.DGD128_Trigger.restype = ctypes.c_int
+
+    @staticmethod
+    def _check_dll():
+        if DS8R._dll is None:
+            raise RuntimeError(
+                'D128RProxy.dll could not be loaded. '
+                'Make sure the original DS8R software is installed.')
+
     @property
     def mode(self) -> int:
-        return self.__mode
+        return self._mode
 
     @mode.setter
     def mode(self, obj: int):
@@ -134,14 +233,15 @@ class DS8R:
                 'Invalid value. Every parameter value must be an integer.')
 
         if obj == 1 or obj == 2:
-            self.__mode = obj
+            self._mode = obj
+            self._params = None
         else:
             raise ValueError(
                 'The parameter "mode" must be either 1 (Monophasic) or 2 (Biphasic).')
 
     @property
     def polarity(self) -> int:
-        return self.__polarity
+        return self._polarity
 
     @polarity.setter
     def polarity(self, obj: int):
@@ -150,14 +250,15 @@ class DS8R:
                 'Invalid value. Every parameter value must be an integer.')
 
         if obj in [1, 2, 3]:
-            self.__polarity = obj
+            self._polarity = obj
+            self._params = None
         else:
             raise ValueError(
                 'The parameter "polarity" must be  either 1 (Positive), 2 (Negative), or 3 (Alternating).')
 
     @property
     def source(self) -> int:
-        return self.__source
+        return self._source
 
     @source.setter
     def source(self, obj: int):
@@ -166,14 +267,15 @@ class DS8R:
                 'Invalid value. Every parameter value must be an integer.')
 
         if obj in [1, 2]:
-            self.__source = obj
+            self._source = obj
+            self._params = None
         else:
             raise ValueError(
                 'The parameter "source" must be either 1 (internal) or 2 (External).')
 
     @property
     def demand(self) -> int:
-        return self.__demand
+        return self._demand
 
     @demand.setter
     def demand(self, obj: int):
@@ -182,18 +284,22 @@ class DS8R:
                 'Invalid value. Every parameter value must be an integer.')
 
         if 1 <= obj <= 150:
-            self.__demand = obj
+            self._demand = obj
+            self._params = None
+            # Always False while the range above caps "demand" at 150;
+            # kept so that `run(force=...)` still works if the cap is raised.
+            self._demand_over_safe = obj > 150
 
             if 1 <= obj <= 19:
-                print('"demand" values from 1 to 19 may not be correctly implemented '
-                      'due to the limitations of the device.')
+                logger.warning('"demand" values from 1 to 19 may not be correctly '
+                               'implemented due to the limitations of the device.')
         else:
             raise ValueError(
                 'The parameter "demand" must be in the range of 1 to 150.')
 
     @property
     def pulse_width(self) -> int:
-        return self.__pulse_width
+        return self._pulse_width
 
     @pulse_width.setter
     def pulse_width(self, obj: int):
@@ -202,7 +308,8 @@ class DS8R:
                 'Invalid value. Every parameter value must be an integer.')
 
         if 50 <= obj <= 2000 and obj % 10 == 0:
-            self.__pulse_width = obj
+            self._pulse_width = obj
+            self._params = None
         else:
             raise ValueError(
                 'The parameter "pulse_width" must be in the range of 50 to 2000, '
@@ -210,7 +317,7 @@ class DS8R:
 
     @property
     def dwell(self) -> int:
-        return self.__dwell
+        return self._dwell
 
     @dwell.setter
     def dwell(self, obj: int):
@@ -219,14 +326,15 @@ class DS8R:
                 'Invalid value. Every parameter value must be an integer.')
 
         if 1 <= obj <= 990:
-            self.__dwell = obj
+            self._dwell = obj
+            self._params = None
         else:
             raise ValueError(
                 'The parameter "dwell" must be in the range of 1 to 990')
 
     @property
     def recovery(self) -> int:
-        return self.__recovery
+        return self._recovery
 
     @recovery.setter
     def recovery(self, obj: int):
@@ -235,14 +343,15 @@ class DS8R:
                 'Invalid value. Every parameter value must be an integer.')
 
         if 10 <= obj <= 100:
-            self.__recovery = obj
+            self._recovery = obj
+            self._params = None
         else:
             raise ValueError(
                 'The parameter "recovery" must be in the range of 10 to 100')
 
     @property
     def enabled(self) -> int:
-        return self.__enabled
+        return self._enabled
 
     @enabled.setter
     def enabled(self, obj):
@@ -251,42 +360,304 @@ class DS8R:
                 'Invalid value. Every parameter value must be an integer.')
 
         if obj == 0 or obj == 1:
-            self.__enabled = obj
+            self._enabled = obj
+            self._params = None
         else:
             raise ValueError(
                 'The parameter "enabled" must be either 0 (disabled) or 1 (enabled).')
 
-    def run(self, force=False):
+    def run(self, force=False, force_upload=False):
         """Change the settings of the DS8R device and trigger an output.
 
+        With D128RProxy.dll loaded, the settings are applied with
+        `upload_parameters()`, which skips the upload when they match the
+        last ones applied through this package.
+
         Parameters
         ---------
         force : bool
             ``True`` allows applying a current greater than 15.0mA,
             which can be dangerous. The default value is ``False``.
+            As the "demand" setter rejects values above 150 (15.0mA),
+            this currently has no effect.
+        force_upload : bool
+            ``True`` applies the settings even if they are unchanged,
+            e.g. after the settings were changed on the front panel.
+            The default value is ``False``.
 
         Raises
         ------
         ValueError
             If the current output is greater than 15.0mA and the 'force' value is ``False``.
         """
-        command = ('"{filename}" {mode} {polarity} {source} {demand} '
-                   '{pulse_width} {dwell} {recovery} {enabled}')\
-            .format(filename=api_path,
-                    mode=self.mode,
-                    polarity=self.polarity,
-                    source=self.source,
-                    demand=self.demand,
-                    pulse_width=self.pulse_width,
-                    dwell=self.dwell,
-                    recovery=self.recovery,
-                    enabled=self.enabled)
-        if self.demand <= 500:
-            os.system(command)
-        elif force:
+        self._check_demand(force)
+
+        if DS8R._dll is None:
+            command = ('"{filename}" {mode} {polarity} {source} {demand} '
+                       '{pulse_width} {dwell} {recovery} {enabled}')\
+                .format(filename=api_path,
+                        mode=self.mode,
+                        polarity=self.polarity,
+                        source=self.source,
+                        demand=self.demand,
+                        pulse_width=self.pulse_width,
+                        dwell=self.dwell,
+                        recovery=self.recovery,
+                        enabled=self.enabled)
             os.system(command)
         else:
+            self.upload_parameters(force_upload)
+            self.fast_trigger()
+
+    def run_train(self, n_pulses: int, interval_us: float, force=False,
+                  force_upload=False):
+        """Change the settings of the DS8R device and trigger a train of outputs.
+
+        The parameters are applied once with `upload_parameters()`, which
+        skips the upload when they match the last ones applied through this
+        package, then the outputs are triggered.
+        Between pulses, the thread sleeps until shortly before the next onset
+        and busy-waits on `time.perf_counter` only for the last few
+        milliseconds, so other threads keep running during the train.
+
+        Successive onsets are never closer than ``interval_us``: if a trigger
+        is delayed, the remaining pulses are delayed with it rather than
+        fired back-to-back to catch up.
+
+        Parameters
+        ----------
+        n_pulses : int
+            Number of outputs to trigger.
+        interval_us : float
+            Interval between the onsets of successive triggers in microseconds.
+        force : bool
+            ``True`` allows applying a current greater than 15.0mA,
+            which can be dangerous. The default value is ``False``.
+            As the "demand" setter rejects values above 150 (15.0mA),
+            this currently has no effect.
+        force_upload : bool
+            ``True`` applies the settings even if they are unchanged,
+            e.g. after the settings were changed on the front panel.
+            The default value is ``False``.
+
+        Raises
+        ------
+        TypeError
+            If ``n_pulses`` is not an integer.
+        ValueError
+            If ``n_pulses`` is not positive, ``interval_us`` is negative or
+            not finite, or the current output is greater than 15.0mA and
+            the 'force' value is ``False``.
+        RuntimeError
+            If D128RProxy.dll could not be loaded.
+        """
+        if not isinstance(n_pulses, int) or isinstance(n_pulses, bool):
+            raise TypeError('"n_pulses" must be an integer.')
+        if n_pulses < 1:
+            raise ValueError('"n_pulses" must be a positive integer.')
+        if not math.isfinite(interval_us) or interval_us < 0:
+            raise ValueError('"interval_us" must be a finite, non-negative number.')
+
+        self._check_demand(force)
+        self.upload_parameters(force_upload)
+
+        trigger = _dll_trigger
+        perf_counter = time.perf_counter
+        sleep = time.sleep
+        interval = interval_us * 1e-6
+        next_time = perf_counter()
+        for _ in range(n_pulses):
+            remaining = next_time - perf_counter()
+            if remaining > _SPIN_WAIT:
+                sleep(remaining - _SPIN_WAIT)
+            while perf_counter() < next_time:
+                pass
+            onset = perf_counter()
+            trigger()
+            # Schedule from the actual onset so that a late pulse never
+            # leaves a shorter gap before the next one.
+            next_time = max(next_time + interval, onset + interval)
+
+    @staticmethod
+    def _wait_pending():
+        # D128RProxy.dll is not known to be thread-safe, so no other DGD128
+        # call may run while an output from `trigger_async()` is in flight.
+        pending = DS8R._pending
+        if pending is not None:
+            wait((pending,))
+
+    @staticmethod
+    def _clear_pending(future):
+        if DS8R._pending is future:
+            DS8R._pending = None
+
+    def _check_demand(self, force):
+        if self._demand_over_safe and not force:
             raise ValueError(
-                'You should be careful when applying "demand" values greater than 124 (12.4mA). '
-                'To apply a current greater than 12.4mA, '
+                'You should be careful when applying "demand" values greater than 150 (15.0mA). '
+                'To apply a current greater than 15.0mA, '
                 'use "c.run(force=True)".')
+
+    def upload_parameters(self, force_upload=False):
+        """Apply the parameters to the DS8R device without triggering an output.
+
+        The upload is skipped when the same parameters were the last ones
+        successfully applied through this package, by this or any other
+        DS8R object.
+
+        Parameters
+        ----------
+        force_upload : bool
+            ``True`` applies the parameters even if they are unchanged,
+            e.g. after the settings were changed on the front panel.
+            The default value is ``False``.
+
+        Returns
+        -------
+        int or None
+            The value returned by ``DGD128_Set``, or ``None`` if the upload
+            was skipped.
+
+        Raises
+        ------
+        RuntimeError
+            If D128RProxy.dll could not be loaded.
+        """
+        self._check_dll()
+        self._wait_pending()
+        params = self._params
+        if params is None:
+            params = self._params = (
+                self._mode, self._polarity, self._source, self._demand,
+                self._pulse_width, self._dwell, self._recovery, self._enabled)
+        if params == DS8R._uploaded and not force_upload:
+            return None
+
+        result = _dll_set(*params)
+        # DGD128_Set returns a positive value on success, and only a
+        # successful upload may be skipped next time.
+        DS8R._uploaded = params if result > 0 else None
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('DGD128_Set returned: %d', result)
+        return result
+
+    def trigger_pulse(self) -> int:
+        """Trigger an output with the settings currently applied to the device.
+
+        Returns
+        -------
+        int
+            The value returned by ``DGD128_Trigger``.
+
+        Raises
+        ------
+        RuntimeError
+            If D128RProxy.dll could not be loaded.
+        """
+        self._check_dll()
+        self._wait_pending()
+        result = _dll_trigger()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('DGD128_Trigger returned: %d', result)
+        return result
+
+    def fast_trigger(self) -> int:
+        """Trigger an output without checking that the DLL is loaded.
+
+        This is the hot path for pulse trains; prefer `trigger_pulse()`
+        unless the per-call overhead matters.
+
+        Returns
+        -------
+        int
+            The value returned by ``DGD128_Trigger``.
+        """
+        if DS8R._pending is not None:
+            self._wait_pending()
+        return _dll_trigger()
+
+    def trigger_async(self):
+        """Trigger an output on a worker thread and return immediately.
+
+        The trigger is submitted to a single worker thread shared by all
+        DS8R objects, so asynchronous triggers run one at a time and in order.
+        The other methods that call D128RProxy.dll wait for the pending
+        output before doing so.
+
+        This neither uploads the parameters of this object nor checks
+        "demand": the output uses whatever settings are already applied to
+        the device. Call `upload_parameters()` first to apply them.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Resolves to the value returned by ``DGD128_Trigger``.
+
+        Raises
+        ------
+        RuntimeError
+            If D128RProxy.dll could not be loaded.
+        """
+        self._check_dll()
+        if DS8R._executor is None:
+            DS8R._executor = ThreadPoolExecutor(max_workers=1)
+        future = DS8R._executor.submit(_dll_trigger)
+        DS8R._last_async = DS8R._pending = future
+        future.add_done_callback(DS8R._clear_pending)
+        return future
+
+    def wait_for_pulse(self, timeout_ms=None):
+        """Wait for the last output submitted by `trigger_async()` from any DS8R object.
+
+        Parameters
+        ----------
+        timeout_ms : float, optional
+            Maximum time to wait in milliseconds. ``None`` waits indefinitely.
+
+        Returns
+        -------
+        int or None
+            The value returned by ``DGD128_Trigger``, or ``None`` if no
+            output has been submitted.
+
+        Raises
+        ------
+        concurrent.futures.TimeoutError
+            If the output is not triggered within ``timeout_ms``.
+        """
+        future = DS8R._last_async
+        if future is None:
+            return None
+        timeout = None if timeout_ms is None else timeout_ms * 1e-3
+        return future.result(timeout)
+
+    def get_state(self, verbose=False) -> dict:
+        """Read the settings currently applied to the DS8R device.
+
+        Parameters
+        ----------
+        verbose : bool
+            ``True`` prints the settings, as DS8R_API does.
+            The default value is ``False``.
+
+        Returns
+        -------
+        dict
+            Parameter names mapped to the values reported by ``DGD128_Get``.
+            The same dict is shared by all DS8R objects and updated in place
+            on every call; use ``.copy()`` to keep a snapshot.
+
+        Raises
+        ------
+        RuntimeError
+            If D128RProxy.dll could not be loaded.
+        """
+        self._check_dll()
+        self._wait_pending()
+        result = _dll_get(*_get_args)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('DGD128_Get returned: %d', result)
+        _state.update(zip(_PARAM_NAMES, _get_buf[:]))
+        if verbose:
+            print(self._STATE_FMT.format(**_state))
+        return _state
@@ -0,0 +1,171 @@
+import copy
+import importlib
+import pickle
+import time
+import unittest
+from unittest import mock
+
+from ds8r import DS8R
+
+ds8r_module = importlib.import_module('ds8r.ds8r')
+
+
+class StubDLL:
+    """Stand-in for D128RProxy.dll that records every DGD128 call."""
+
+    def __init__(self, set_result=1):
+        self.set_result = set_result
+        self.calls = []
+
+    def DGD128_Set(self, *params):
+        self.calls.append(('set', params))
+        return self.set_result
+
+    def DGD128_Get(self, *refs):
+        self.calls.append(('get',))
+        ds8r_module._get_buf[:] = (2, 1, 1, 30, 200, 1, 100, 1)
+        return 1
+
+    def DGD128_Trigger(self):
+        self.calls.append(('trigger',))
+        return 1
+
+
+class StubDLLTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dll = StubDLL()
+        patches = [
+            mock.patch.object(DS8R, '_dll', self.dll),
+            mock.patch.object(DS8R, '_dll_loaded', True),
+            mock.patch.object(DS8R, '_uploaded', None),
+            mock.patch.object(DS8R, '_pending', None),
+            mock.patch.object(DS8R, '_last_async', None),
+            mock.patch.object(ds8r_module, '_dll_set', self.dll.DGD128_Set),
+            mock.patch.object(ds8r_module, '_dll_get', self.dll.DGD128_Get),
+            mock.patch.object(ds8r_module, '_dll_trigger', self.dll.DGD128_Trigger),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def set_calls(self):
+        return [call for call in self.dll.calls if call[0] == 'set']
+
+
+class TestUploadParameters(StubDLLTestCase):
+
+    def test_unchanged_parameters_are_uploaded_once(self):
+        c = DS8R()
+        c.run()
+        c.run()
+        self.assertEqual(len(self.set_calls()), 1)
+        self.assertEqual(self.dll.calls.count(('trigger',)), 2)
+
+    def test_changed_parameter_is_uploaded(self):
+        c = DS8R()
+        c.run()
+        c.demand = 30
+        c.run()
+        self.assertEqual([call[1][3] for call in self.set_calls()], [20, 30])
+
+    def test_other_instance_invalidates_upload(self):
+        a = DS8R(demand=20)
+        b = DS8R(demand=30)
+        a.run()
+        b.run()
+        a.run()
+        self.assertEqual([call[1][3] for call in self.set_calls()], [20, 30, 20])
+
+    def test_failed_upload_is_retried(self):
+        self.dll.set_result = -1
+        c = DS8R()
+        self.assertEqual(c.upload_parameters(), -1)
+        self.dll.set_result = 1
+        self.assertEqual(c.upload_parameters(), 1)
+        self.assertIsNone(c.upload_parameters())
+        self.assertEqual(len(self.set_calls()), 2)
+
+    def test_force_upload(self):
+        c = DS8R()
+        c.run()
+        c.run(force_upload=True)
+        self.assertEqual(len(self.set_calls()), 2)
+
+
+class TestRunTrain(StubDLLTestCase):
+
+    def test_delayed_trigger_does_not_compress_intervals(self):
+        onsets = []
+
+        def trigger():
+            onsets.append(time.perf_counter())
+            if len(onsets) == 2:
+                time.sleep(0.035)
+            return 1
+
+        ds8r_module._dll_trigger = trigger
+        DS8R().run_train(6, 10000)
+
+        gaps = [b - a for a, b in zip(onsets, onsets[1:])]
+        self.assertEqual(len(onsets), 6)
+        self.assertGreaterEqual(min(gaps), 0.0099)
+
+    def test_invalid_n_pulses(self):
+        c = DS8R()
+        for n_pulses in (1.5, '3', True):
+            with self.assertRaises(TypeError):
+                c.run_train(n_pulses, 1000)
+        with self.assertRaises(ValueError):
+            c.run_train(0, 1000)
+
+    def test_invalid_interval(self):
+        c = DS8R()
+        for interval_us in (-1, float('nan'), float('inf')):
+            with self.assertRaises(ValueError):
+                c.run_train(2, interval_us)
+        self.assertEqual(self.dll.calls, [])
+
+
+class TestInstances(StubDLLTestCase):
+
+    def test_get_state(self):
+        self.assertEqual(DS8R().get_state(),
+                         {'mode': 2, 'polarity': 1, 'source': 1, 'demand': 30,
+                          'pulse_width': 200, 'dwell': 1, 'recovery': 100,
+                          'enabled': 1})
+
+    def test_copy_and_pickle(self):
+        c = DS8R(demand=30, pulse_width=200)
+        for other in (copy.copy(c), copy.deepcopy(c),
+                      pickle.loads(pickle.dumps(c))):
+            self.assertEqual((other.demand, other.pulse_width), (30, 200))
+            other.demand = 40
+            self.assertEqual(c.demand, 30)
+
+
+class TestTriggerAsync(StubDLLTestCase):
+
+    def test_dll_calls_wait_for_async_trigger(self):
+        def trigger():
+            time.sleep(0.05)
+            self.dll.calls.append(('trigger',))
+            return 1
+
+        ds8r_module._dll_trigger = trigger
+        a = DS8R(demand=20)
+        b = DS8R(demand=30)
+        a.trigger_async()
+        b.upload_parameters()
+        a.trigger_async()
+        b.get_state()
+        self.assertEqual(b.wait_for_pulse(1000), 1)
+        self.assertEqual([call[0] for call in self.dll.calls],
+                         ['trigger', 'set', 'trigger', 'get'])
+
+    def test_wait_for_pulse_without_trigger(self):
+        self.assertIsNone(DS8R().wait_for_pulse())
+
+
+if __name__ == '__main__':
+    unittest.main()